@@ -1,215 +1,312 @@
 #!/usr/bin/env python3
 
-import argparse
-import io
+import hashlib
+import inspect
 import os
+import subprocess
 import sys
-from abc import ABC, abstractmethod
-from typing import Dict, List
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Tuple
 
 
+@dataclass(frozen=True, slots=True)
 class ASTDef:
-    def __init__(self, name: str, fields: Dict[str, str]):
-        self.name = name
-        self.fields = fields
-
-
-EXPRESSIONS = [
-    ASTDef('Assign', {
-        'name': 'Token',
-        'value': 'Expression',
-    }),
-    ASTDef('Binary', {
-        'left': 'Expression',
-        'operator': 'Token',
-        'right': 'Expression',
-    }),
-    ASTDef('Ternary', {
-        'condition': 'Expression',
-        'true': 'Expression',
-        'false': 'Expression',
-    }),
-    ASTDef('Unary', {
-        'operator': 'Token',
-        'right': 'Expression',
-    }),
-    ASTDef('Grouping', {
-        'expression': 'Expression',
-    }),
-    ASTDef('Literal', {
-        'value': 'Object',
-    }),
-    ASTDef('Variable', {
-        'name': 'Token',
-    }),
-]
-
-STATEMENTS = [
-    ASTDef('Expression', {
-        'expression': 'Expression',
-    }),
-    ASTDef('Print', {
-        'expression': 'Expression',
-    }),
-    ASTDef('Var', {
-        'name': 'Token',
-        'initializer': 'Expression',
-    }),
-]
-
-
-class Generator(ABC):
-    def __init__(self, output_dir: str, extension: str, format_cmd: str):
-        # TODO: instead of passing anything into this we can just use
-        # some more abstract properties and methods for them
-
-        self.__format_cmd = format_cmd
-
-        self.__expression_output_file_path = os.path.join(output_dir, f'expression.{extension}')
-        self.__statement_output_file_path = os.path.join(output_dir, f'statement.{extension}')
-
-    @property
-    @abstractmethod
-    def language(self) -> str:
-        pass
-
-    @abstractmethod
-    def _write_header(self, type: str, f: io.TextIOWrapper):
-        pass
-
-    @abstractmethod
-    def _write_interface(self, type: str, f: io.TextIOWrapper):
-        pass
-
-    @abstractmethod
-    def _generate_visitors(self, type: str, ast_defs: List[ASTDef], f: io.TextIOWrapper):
-        pass
-
-    @abstractmethod
-    def _generate_definition(self, type: str, ast_def: ASTDef, f: io.TextIOWrapper):
-        pass
-
-    def __generate_definitions(self, type: str, file_path: str, ast_defs: List[ASTDef]):
-        print(f'Generating {self.language} {type}s to "{file_path}" ...')
-
-        with open(file_path, 'w', encoding='utf-8') as f:
-            self._write_header(type, f)
-            self._write_interface(type, f)
-
-            for ast_def in ast_defs:
-                self._generate_definition(type, ast_def, f)
-
-            self._generate_visitors(type, ast_defs, f)
-
-        # format the file
-        format_cmd = f'{self.__format_cmd} {file_path}'
-        print(f'Formatting output "{format_cmd}" ...')
-        os.system(format_cmd)
-
-    def __generate_expressions(self):
-        self.__generate_definitions(
-            'Expression', self.__expression_output_file_path, EXPRESSIONS)
-
-    def __generate_statements(self):
-        self.__generate_definitions(
-            'Statement', self.__statement_output_file_path, STATEMENTS)
-
-    def generate(self):
-        self.__generate_expressions()
-        self.__generate_statements()
-
-
-class GoGenerator(Generator):
-    def __init__(self):
-        super().__init__(os.path.join('golox'), 'go', 'gofmt -w')
-
-        self.__constraints = {
-            'Expression': ['string', 'Value'],
-        }
-
-    @property
-    def language(self) -> str:
-        return "Go"
-
-    def _write_header(self, type: str, f: io.TextIOWrapper):
-        f.write("""/* This file is autogenerated, DO NOT MODIFY */
+    name: str
+    fields: Tuple[Tuple[str, str], ...]
+
+    # capitalized field names are needed for every emission,
+    # so compute them once up front
+    cap_fields: Tuple[Tuple[str, str], ...] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(
+            self, 'cap_fields',
+            tuple((field_name.capitalize(), field_type)
+                  for field_name, field_type in self.fields))
+
+
+EXPRESSIONS = (
+    ASTDef('Assign', (
+        ('name', 'Token'),
+        ('value', 'Expression'),
+    )),
+    ASTDef('Binary', (
+        ('left', 'Expression'),
+        ('operator', 'Token'),
+        ('right', 'Expression'),
+    )),
+    ASTDef('Ternary', (
+        ('condition', 'Expression'),
+        ('true', 'Expression'),
+        ('false', 'Expression'),
+    )),
+    ASTDef('Unary', (
+        ('operator', 'Token'),
+        ('right', 'Expression'),
+    )),
+    ASTDef('Grouping', (
+        ('expression', 'Expression'),
+    )),
+    ASTDef('Literal', (
+        ('value', 'Object'),
+    )),
+    ASTDef('Variable', (
+        ('name', 'Token'),
+    )),
+)
+
+STATEMENTS = (
+    ASTDef('Expression', (
+        ('expression', 'Expression'),
+    )),
+    ASTDef('Print', (
+        ('expression', 'Expression'),
+    )),
+    ASTDef('Var', (
+        ('name', 'Token'),
+        ('initializer', 'Expression'),
+    )),
+)
+
+# the tables are frozen after this point, so hash them once at import;
+# anything keyed on their contents (the regeneration skip gate, future
+# incremental backends) shares this instead of rehashing per run
+_AST_TABLES_HASH = hashlib.blake2b(
+    repr((EXPRESSIONS, STATEMENTS)).encode('utf-8')).hexdigest()
+
+
+def ast_tables_hash() -> str:
+    return _AST_TABLES_HASH
+
+
+# Go overrides for the field types used in the AST tables
+GO_TYPE_MAP = {
+    'Object': 'LiteralValue',
+    'Token': '*Token',
+}
+
+# Go output templates, built once at module import and rendered with
+# str.format() so per-node emission is just placeholder substitution
+
+_GO_HEADER_TEMPLATE = '''/* This file is autogenerated, DO NOT MODIFY */
 package main
-""")
-
-    def _write_interface(self, type: str, f: io.TextIOWrapper):
-        f.write(f'\ntype {type} interface {{')
-        if type in self.__constraints:
-            for constraint in self.__constraints[type]:
-                f.write(
-                    f'Accept{constraint.capitalize()}(visitor {type}Visitor[{constraint}]) ({constraint}, error)\n')
-        else:
-            f.write(
-                f'Accept(visitor {type}Visitor) (error)\n')
-        f.write('}\n')
-
-    def _generate_visitors(self, type: str, ast_defs: List[ASTDef], f: io.TextIOWrapper):
-        # visitor type constraint
-        if type in self.__constraints:
-            f.write(f"""
-type {type}VisitorConstraint interface {{
-    {' | '.join(self.__constraints[type])}
+'''
+
+_GO_INTERFACE_TEMPLATE = '''
+type {type} interface {{{methods}}}
+'''
+
+_GO_STRUCT_TEMPLATE = '''
+type {name}{type} struct {{
+{fields}}}
+'''
+
+_GO_ACCEPT_CONSTRAINT_TEMPLATE = '''
+func (e *{name}{type}) Accept{cap_constraint}(visitor {type}Visitor[{constraint}]) ({constraint}, error) {{
+    return visitor.Visit{name}{type}(e)
 }}
-""")
-
-        # visitor interface
-        if type in self.__constraints:
-            f.write(f'\ntype {type}Visitor[T {type}VisitorConstraint] interface {{\n')
-            for ast_def in ast_defs:
-                f.write(
-                    f'Visit{ast_def.name}{type}({type.lower()} *{ast_def.name}{type}) (T, error)\n')
-        else:
-            f.write(f'\ntype {type}Visitor interface {{\n')
-            for ast_def in ast_defs:
-                f.write(
-                    f'Visit{ast_def.name}{type}({type.lower()} *{ast_def.name}{type}) (error)\n')
-        f.write('}\n')
-
-    def _generate_definition(self, type: str, ast_def: ASTDef, f: io.TextIOWrapper):
-        # type
-        f.write(f'\ntype {ast_def.name}{type} struct {{\n')
-        for field_name, field_type in ast_def.fields.items():
-            # do some type overriding
-            match field_type:
-                case 'Object':
-                    field_type = 'LiteralValue'
-                case 'Token':
-                    field_type = '*Token'
-            f.write(f'{field_name.capitalize()} {field_type}\n')
-        f.write('}\n')
-
-        # visitor interface
-        if type in self.__constraints:
-            for constraint in self.__constraints[type]:
-                f.write(f"""
-func (e *{ast_def.name}{type}) Accept{constraint.capitalize()}(visitor {type}Visitor[{constraint}]) ({constraint}, error) {{
-    return visitor.Visit{ast_def.name}{type}(e)
+'''
+
+_GO_ACCEPT_TEMPLATE = '''
+func (e *{name}{type}) Accept(visitor {type}Visitor) (error) {{
+    return visitor.Visit{name}{type}(e)
 }}
-""")
-        else:
-            f.write(f"""
-func (e *{ast_def.name}{type}) Accept(visitor {type}Visitor) (error) {{
-    return visitor.Visit{ast_def.name}{type}(e)
+'''
+
+_GO_VISITOR_CONSTRAINT_TEMPLATE = '''
+type {type}VisitorConstraint interface {{
+    {constraints}
 }}
-""")
+'''
 
+_GO_VISITOR_GENERIC_TEMPLATE = '''
+type {type}Visitor[T {type}VisitorConstraint] interface {{
+{methods}}}
+'''
 
-GENERATORS = {
-    'go': GoGenerator(),
+_GO_VISITOR_TEMPLATE = '''
+type {type}Visitor interface {{
+{methods}}}
+'''
+
+
+GO_CONSTRAINTS = {
+    'Expression': ['string', 'Value'],
+}
+
+# these only depend on the constraint lists, so render them once at
+# import instead of on every visitor/definition emission
+_GO_CONSTRAINT_UNIONS = {
+    type: ' | '.join(constraints)
+    for type, constraints in GO_CONSTRAINTS.items()
+}
+_GO_CAP_CONSTRAINTS = {
+    type: [(constraint, constraint.capitalize()) for constraint in constraints]
+    for type, constraints in GO_CONSTRAINTS.items()
+}
+
+
+def go_write_header(type: str, parts: List[str]):
+    parts.append(_GO_HEADER_TEMPLATE)
+
+
+def go_write_interface(type: str, parts: List[str]):
+    if type in GO_CONSTRAINTS:
+        methods = ''.join(
+            f'Accept{cap_constraint}(visitor {type}Visitor[{constraint}]) ({constraint}, error)\n'
+            for constraint, cap_constraint in _GO_CAP_CONSTRAINTS[type])
+    else:
+        methods = f'Accept(visitor {type}Visitor) (error)\n'
+    parts.append(_GO_INTERFACE_TEMPLATE.format(type=type, methods=methods))
+
+
+def go_generate_visitors(type: str, ast_defs: Tuple[ASTDef, ...], parts: List[str]):
+    type_lower = type.lower()
+
+    # visitor type constraint
+    if type in GO_CONSTRAINTS:
+        parts.append(_GO_VISITOR_CONSTRAINT_TEMPLATE.format(
+            type=type, constraints=_GO_CONSTRAINT_UNIONS[type]))
+
+    # visitor interface
+    if type in GO_CONSTRAINTS:
+        methods = ''.join(
+            f'Visit{ast_def.name}{type}({type_lower} *{ast_def.name}{type}) (T, error)\n'
+            for ast_def in ast_defs)
+        parts.append(_GO_VISITOR_GENERIC_TEMPLATE.format(type=type, methods=methods))
+    else:
+        methods = ''.join(
+            f'Visit{ast_def.name}{type}({type_lower} *{ast_def.name}{type}) (error)\n'
+            for ast_def in ast_defs)
+        parts.append(_GO_VISITOR_TEMPLATE.format(type=type, methods=methods))
+
+
+def go_generate_definition(type: str, ast_def: ASTDef, parts: List[str]):
+    # type (with some type overriding)
+    fields = ''.join(
+        f'{cap_field_name} {GO_TYPE_MAP.get(field_type, field_type)}\n'
+        for cap_field_name, field_type in ast_def.cap_fields)
+
+    # visitor interface
+    if type in GO_CONSTRAINTS:
+        accepts = ''.join(
+            _GO_ACCEPT_CONSTRAINT_TEMPLATE.format(
+                name=ast_def.name, type=type,
+                constraint=constraint, cap_constraint=cap_constraint)
+            for constraint, cap_constraint in _GO_CAP_CONSTRAINTS[type])
+    else:
+        accepts = _GO_ACCEPT_TEMPLATE.format(name=ast_def.name, type=type)
+
+    # one append per AST node: the struct plus its Accept methods
+    parts.append(_GO_STRUCT_TEMPLATE.format(
+        name=ast_def.name, type=type, fields=fields) + accepts)
+
+
+# a backend is just its settings plus the emitter callables - there is
+# no per-backend state, so no need for classes or method dispatch
+Backend = namedtuple('Backend', [
+    'language', 'output_dir', 'extension', 'format_cmd',
+    'write_header', 'write_interface', 'generate_definition', 'generate_visitors',
+])
+
+
+def _generation_key() -> str:
+    # key on the generator module source and the AST tables so any
+    # change to either forces a regeneration
+    source = inspect.getsource(sys.modules[__name__])
+    return hashlib.blake2b(
+        source.encode('utf-8')
+        + ast_tables_hash().encode('utf-8')).hexdigest()
+
+
+def _is_up_to_date(key: str, hash_file_path: str, output_file_paths: Tuple[str, ...]) -> bool:
+    if not all(os.path.exists(file_path) for file_path in output_file_paths):
+        return False
+
+    try:
+        with open(hash_file_path, encoding='utf-8') as f:
+            return f.read() == key
+    except FileNotFoundError:
+        return False
+
+
+def _generate_definitions(backend: Backend, type: str, file_path: str, ast_defs: Tuple[ASTDef, ...]):
+    print(f'Generating {backend.language} {type}s to "{file_path}" ...')
+
+    # build the file in memory so we only hit the disk once
+    parts: List[str] = []
+
+    backend.write_header(type, parts)
+    backend.write_interface(type, parts)
+
+    for ast_def in ast_defs:
+        backend.generate_definition(type, ast_def, parts)
+
+    backend.generate_visitors(type, ast_defs, parts)
+
+    # pipe the source through the formatter rather than formatting
+    # on disk, so the unformatted version is never written out
+    result = subprocess.run(
+        backend.format_cmd.split(), input=''.join(parts),
+        capture_output=True, text=True, check=True)
+
+    # write the whole file in a single syscall, skipping the
+    # TextIOWrapper/BufferedWriter layers
+    data = result.stdout.encode('utf-8')
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _generate_backend(backend: Backend):
+    # plain '/' joins: these are known-relative paths and Go tooling
+    # is fine with forward slashes everywhere
+    expression_file_path = f'{backend.output_dir}/expression.{backend.extension}'
+    statement_file_path = f'{backend.output_dir}/statement.{backend.extension}'
+    hash_file_path = f'{backend.output_dir}/.ast_gen_hash'
+
+    key = _generation_key()
+    if _is_up_to_date(key, hash_file_path, (expression_file_path, statement_file_path)):
+        print(f'{backend.language} output is up to date, skipping ...')
+        return
+
+    # the output files are independent, so write them concurrently
+    # (the hot path is I/O and waiting on the formatter,
+    # which both release the GIL)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(_generate_definitions, backend,
+                            'Expression', expression_file_path, EXPRESSIONS),
+            executor.submit(_generate_definitions, backend,
+                            'Statement', statement_file_path, STATEMENTS),
+        ]
+        for future in futures:
+            future.result()
+
+    with open(hash_file_path, 'w', encoding='utf-8') as f:
+        f.write(key)
+
+
+BACKENDS = {
+    'go': Backend('Go', 'golox', 'go', 'gofmt',
+                  go_write_header, go_write_interface,
+                  go_generate_definition, go_generate_visitors),
 }
 
 
 def generate(languages: List[str]):
-    for language in languages:
-        if language in GENERATORS:
-            GENERATORS[language].generate()
+    with ThreadPoolExecutor(max_workers=max(1, len(languages))) as executor:
+        futures = [executor.submit(_generate_backend, BACKENDS[language])
+                   for language in languages if language in BACKENDS]
+        for future in futures:
+            future.result()
 
 
-def main(args: argparse.Namespace):
+def main(args: 'argparse.Namespace'):
     match args.command:
         case 'generate':
             generate(args.languages)
@@ -219,12 +316,20 @@ def main(args: argparse.Namespace):
 
 
 if __name__ == "__main__":
+    # fast path for the common bare invocation, skipping argparse
+    # (parser construction costs more than the generation itself)
+    if sys.argv[1:] == ['generate']:
+        generate(list(BACKENDS))
+        sys.exit(0)
+
+    import argparse
+
     parser = argparse.ArgumentParser(description='AST codegen')
 
     subparsers = parser.add_subparsers(dest='command', help='sub-command help', required=True)
 
     subparser = subparsers.add_parser('generate')
-    subparser.add_argument('--languages', nargs='+', choices=GENERATORS.keys(), default=GENERATORS.keys(),
+    subparser.add_argument('--languages', nargs='+', choices=BACKENDS.keys(), default=BACKENDS.keys(),
                            help='Which languages to generate for')
 
     args = parser.parse_args()